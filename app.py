@@ -1,26 +1,38 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response
 import json
 import os
 from dotenv import load_dotenv
 load_dotenv()
 from datetime import datetime, timedelta
 import sqlite3
+from contextlib import contextmanager
+from queue import Queue
 from io import BytesIO
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import secrets
 import hashlib
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+import bcrypt
 from urllib.parse import urljoin, urlparse
 from html import unescape
 import re
+import time
+import asyncio
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import wraps
+from functools import wraps, lru_cache
 from werkzeug.exceptions import RequestEntityTooLarge, HTTPException
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks (init_db stays idempotent)
+    fcntl = None
+
 # Optional dependencies for Excel import/export
 try:
     import pandas as pd
@@ -34,6 +46,35 @@ try:
 except ImportError:
     OPENPYXL_AVAILABLE = False
 
+# Optional native HTML parser for training crawls (falls back to regex parsing)
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    SELECTOLAX_AVAILABLE = True
+except ImportError:
+    SELECTOLAX_AVAILABLE = False
+
+# Optional asyncio HTTP client for high fan-out /train crawls (falls back to a thread pool)
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+# Optional fast JSON codec for hot paths (falls back to the stdlib json module)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def json_loads(raw):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+# Helper: JSON response without jsonify's encoder overhead (used on the dashboard hot paths)
+def ojson(obj, status=200):
+    body = orjson.dumps(obj) if ORJSON_AVAILABLE else json.dumps(obj)
+    return Response(body, status=status, mimetype='application/json')
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'whatsapp_business_secret_key_2024')
 app.config['ENV'] = 'production'
@@ -45,168 +86,319 @@ app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB
 # Basic logging
 logging.basicConfig(level=logging.INFO)
 
+# Optional server-side sessions in Redis (set REDIS_URL); the cookie then only carries a random session id.
+# Without it, Flask's default signed-cookie sessions are used.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    try:
+        import redis
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(REDIS_URL)
+        Session(app)
+    except ImportError:
+        logging.warning('REDIS_URL is set but Flask-Session/redis are not installed; using cookie sessions')
+
+# Background executor for outgoing email so SMTP round-trips don't block request workers
+EMAIL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='smtp')
+
+# Background executor for WhatsApp replies so /webhook can ACK Meta immediately,
+# plus a shared keep-alive session so successive replies reuse the TLS connection to graph.facebook.com
+WA_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='whatsapp')
+GRAPH_SESSION = requests.Session()
+GRAPH_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+GRAPH_TIMEOUT = (3, 5)  # (connect, read) seconds, so a hung Graph API call can't stall a worker
+
+# Shared HTTP session for training crawls: pooled keep-alive connections (TLS reuse) and light retries
+CRAWL_MAX_BYTES = 2_000_000  # read at most ~2 MB of any crawled page
+CRAWL_CONCURRENCY = 32  # in-flight requests for async /train crawls
+CRAWL_RETRIES = 2  # retries per URL on connection errors/timeouts
+CRAWL_SESSION = requests.Session()
+CRAWL_SESSION.headers['User-Agent'] = 'Mozilla/5.0'
+_crawl_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3))
+CRAWL_SESSION.mount('http://', _crawl_adapter)
+CRAWL_SESSION.mount('https://', _crawl_adapter)
+
 # Configurable database path (for Railway volume persistence). For production, consider migrating to PostgreSQL.
 DB_PATH = os.environ.get('DATABASE_PATH', 'whatsapp_business.db')
 
+# Pooled SQLite connections: reuse open file handles and warm page caches across requests.
+# WAL + synchronous=NORMAL: commits append to the WAL without an fsync (syncs happen at checkpoints) and readers never block the writer.
+DB_POOL_SIZE = 8
+_pool = Queue(maxsize=DB_POOL_SIZE)
+
+def _new_conn():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA wal_autocheckpoint=1000')
+    return conn
+
+for _ in range(DB_POOL_SIZE):
+    _pool.put(_new_conn())
+
+@contextmanager
+def get_conn():
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        # Discard anything left uncommitted, as closing a connection would
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put(conn)
+
+# Password hashing: bcrypt for new hashes; werkzeug (pbkdf2/scrypt) hashes from older installs still verify
+BCRYPT_ROUNDS = 12
+LEGACY_HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+PASSWORD_HASH_PREFIXES = LEGACY_HASH_PREFIXES + ('$2',)
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+def verify_password(stored_hash, password):
+    if stored_hash.startswith('$2'):
+        return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+    return check_password_hash(stored_hash, password)
+
+# Bump whenever init_db's schema or migrations change; databases already at this version skip init
+SCHEMA_VERSION = 3
+
+# Serialize init_db across worker processes booting at the same time
+@contextmanager
+def _init_lock():
+    with open(DB_PATH + '.initlock', 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
 # Database initialization
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Create FAQs table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS faqs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT NOT NULL,
-            answer TEXT NOT NULL,
-            parent_id INTEGER DEFAULT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (parent_id) REFERENCES faqs (id)
-        )
-    ''')
-    # Create settings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key TEXT UNIQUE NOT NULL,
-            value TEXT NOT NULL
-        )
-    ''')
-    # Create password reset tokens table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS password_reset_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL,
-            token TEXT UNIQUE NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            used BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Create users table for admin credentials
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Create knowledge table to store website content
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS knowledge (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            url TEXT NOT NULL,
-            title TEXT,
-            content TEXT NOT NULL,
-            images TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Migration: ensure 'images' column exists for older DBs
-    try:
-        cursor.execute("PRAGMA table_info(knowledge)")
-        cols = [row[1] for row in cursor.fetchall()]
-        if 'images' not in cols:
-            cursor.execute("ALTER TABLE knowledge ADD COLUMN images TEXT")
-        # Migration: add 'domain' column to scope knowledge to a company/site
-        cursor.execute("PRAGMA table_info(knowledge)")
-        cols = [row[1] for row in cursor.fetchall()]
-        if 'domain' not in cols:
-            cursor.execute("ALTER TABLE knowledge ADD COLUMN domain TEXT")
-    except Exception:
-        pass
-    # Create contacts table to track WhatsApp user greeting state
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone TEXT UNIQUE NOT NULL,
-            welcomed BOOLEAN DEFAULT FALSE,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Insert default settings
-    cursor.execute('''
-        INSERT OR IGNORE INTO settings (key, value) VALUES
-        ('whatsapp_api_token', ''),
-        ('whatsapp_phone_number', ''),
-        ('whatsapp_phone_number_id', ''),
-        ('webhook_verify_token', ''),
-        ('greeting_message', 'Dear Esteemed Guest, Welcome to Souq Waqif Boutique Hotels by Tivoli. I am your Virtual Butler and remain at your service. Please select from the options below for your convenience.'),
-        ('smtp_server', 'smtp.gmail.com'),
-        ('smtp_port', '587'),
-        ('smtp_username', ''),
-        ('smtp_password', ''),
-        ('admin_email', 'admin@example.com')
-    ''')
-    # Insert default admin user with hashed password (change this immediately after deployment!)
-    hashed_password = generate_password_hash('Admin')
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (username, password, email) VALUES (?, ?, ?)
-    ''', ('Admin', hashed_password, 'admin@example.com'))
-    # Migration for existing users: Hash any plaintext passwords (for backward compatibility)
-    cursor.execute('SELECT id, password FROM users')
-    for row in cursor.fetchall():
-        user_id, stored_password = row
-        if not stored_password.startswith('pbkdf2:'):
-            hashed = generate_password_hash(stored_password)  # Assume stored_password was plaintext
-            cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
-    conn.commit()
-    conn.close()
-
-# Initialize database at import time (Flask 3.x safe; idempotent)
+    with _init_lock(), get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # Create FAQs table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS faqs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                parent_id INTEGER DEFAULT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (parent_id) REFERENCES faqs (id)
+            )
+        ''')
+        # Create settings table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT UNIQUE NOT NULL,
+                value TEXT NOT NULL
+            )
+        ''')
+        # Create password reset tokens table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS password_reset_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                token TEXT UNIQUE NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                used BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Create users table for admin credentials
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                email TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Create knowledge table to store website content
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                title TEXT,
+                content TEXT NOT NULL,
+                images TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Migration: ensure 'images' column exists for older DBs
+        try:
+            cursor.execute("PRAGMA table_info(knowledge)")
+            cols = [row[1] for row in cursor.fetchall()]
+            if 'images' not in cols:
+                cursor.execute("ALTER TABLE knowledge ADD COLUMN images TEXT")
+            # Migration: add 'domain' column to scope knowledge to a company/site
+            cursor.execute("PRAGMA table_info(knowledge)")
+            cols = [row[1] for row in cursor.fetchall()]
+            if 'domain' not in cols:
+                cursor.execute("ALTER TABLE knowledge ADD COLUMN domain TEXT")
+            # Migration: add 'content_sha' so re-crawling identical pages doesn't duplicate rows
+            if 'content_sha' not in cols:
+                cursor.execute("ALTER TABLE knowledge ADD COLUMN content_sha TEXT")
+        except Exception:
+            pass
+        # Create contacts table to track WhatsApp user greeting state
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone TEXT UNIQUE NOT NULL,
+                welcomed BOOLEAN DEFAULT FALSE,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Indexes for sub-FAQ lookups/deletes, reset-token lookups by email, password resets by user email
+        # and domain-scoped knowledge queries (password_reset_tokens.token is already UNIQUE, hence indexed)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_faqs_parent ON faqs(parent_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reset_email ON password_reset_tokens(email)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_domain ON knowledge(domain)')
+        # De-duplicate per domain, so a page whose text is already stored for another domain is still saved for its own.
+        # Older rows have a NULL content_sha, which a UNIQUE index allows any number of. (v2 indexed content_sha alone.)
+        cursor.execute('DROP INDEX IF EXISTS idx_knowledge_content_sha')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_domain_sha ON knowledge(domain, content_sha)')
+        # Full-text indexes over FAQs and knowledge; external-content tables kept in sync by triggers
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('faqs_fts', 'knowledge_fts')")
+        existing_fts = {row[0] for row in cursor.fetchall()}
+        for table, cols in (('faqs', ('question', 'answer')), ('knowledge', ('title', 'content'))):
+            fts = f'{table}_fts'
+            col_list = ', '.join(cols)
+            new_vals = ', '.join(f'new.{c}' for c in cols)
+            old_vals = ', '.join(f'old.{c}' for c in cols)
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col_list}, content='{table}', content_rowid='id')")
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {col_list}) VALUES (new.id, {new_vals});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+                    INSERT INTO {fts} (rowid, {col_list}) VALUES (new.id, {new_vals});
+                END
+            ''')
+            # Index rows that existed before the FTS table was created
+            if fts not in existing_fts:
+                cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        # Insert default settings
+        cursor.execute('''
+            INSERT OR IGNORE INTO settings (key, value) VALUES
+            ('whatsapp_api_token', ''),
+            ('whatsapp_phone_number', ''),
+            ('whatsapp_phone_number_id', ''),
+            ('webhook_verify_token', ''),
+            ('greeting_message', 'Dear Esteemed Guest, Welcome to Souq Waqif Boutique Hotels by Tivoli. I am your Virtual Butler and remain at your service. Please select from the options below for your convenience.'),
+            ('smtp_server', 'smtp.gmail.com'),
+            ('smtp_port', '587'),
+            ('smtp_username', ''),
+            ('smtp_password', ''),
+            ('admin_email', 'admin@example.com')
+        ''')
+        # Insert default admin user with hashed password (change this immediately after deployment!)
+        # Only hash when the user is missing so boots don't pay the bcrypt cost every time
+        cursor.execute('SELECT 1 FROM users WHERE username = ?', ('Admin',))
+        if not cursor.fetchone():
+            cursor.execute('''
+                INSERT OR IGNORE INTO users (username, password, email) VALUES (?, ?, ?)
+            ''', ('Admin', hash_password('Admin'), 'admin@example.com'))
+        # Migration for existing users: Hash any plaintext passwords (for backward compatibility)
+        cursor.execute('SELECT id, password FROM users')
+        for row in cursor.fetchall():
+            user_id, stored_password = row
+            if not stored_password.startswith(PASSWORD_HASH_PREFIXES):
+                hashed = hash_password(stored_password)  # Assume stored_password was plaintext
+                cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+
+# Initialize database once at import time (Flask 3.x safe; no-op when the schema is current)
 init_db()
 
+# In-process settings cache: key -> (fetched_at, value); a None value marks a missing key.
+# Entries expire after the TTL so changes made by other workers are picked up.
+SETTINGS_CACHE_TTL = 60  # seconds
+_settings_cache = {}
+
+# Helper to fetch several settings at once, querying SQLite only for keys not cached
+def get_settings(keys, default=None):
+    now = time.monotonic()
+    values = {}
+    missing = []
+    for key in keys:
+        cached = _settings_cache.get(key)
+        if cached and now - cached[0] < SETTINGS_CACHE_TTL:
+            values[key] = cached[1]
+        else:
+            missing.append(key)
+    if missing:
+        placeholders = ', '.join('?' * len(missing))
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT key, value FROM settings WHERE key IN ({placeholders})', missing)
+            found = dict(cursor.fetchall())
+        for key in missing:
+            values[key] = found.get(key)
+            _settings_cache[key] = (now, values[key])
+    return {key: (default if values[key] is None else values[key]) for key in keys}
+
 # Helper to fetch a setting value by key
 def get_setting(key, default=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else default
+    return get_settings([key], default)[key]
+
+# Helper to update several settings in one transaction
+def update_settings(items):
+    with get_conn() as conn, conn:
+        conn.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', list(items.items()))
+    for key in items:
+        _settings_cache.pop(key, None)
+    # Greeting and current domain feed into replies
+    clear_response_cache()
 
 # Helper to update a setting
 def update_setting(key, value):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
-    conn.commit()
-    conn.close()
+    update_settings({key: value})
+
+# Comprehensive moderation list: dangerous, sexual, and cursing.
+# Compiled once into a single case-insensitive alternation so each message is scanned in one pass.
+_MODERATION_PATTERNS = [
+    # Cursing / profanity
+    r"fuck|shit|bitch|asshole|bastard|dick|pussy|motherfucker|mf|cunt|slut|whore|prick",
+    # Sexual content
+    r"sex|sexual|porn|pornography|nude|nudity|blowjob|handjob|anal|fetish|erotic|xxx",
+    # Dangerous / violent / illegal
+    r"bomb|kill|murder|suicide|terror(ist|ism)?|attack|shoot(ing)?|gun|weapon|drugs?|heroin|cocaine|meth|hack(ing|er)?|breach",
+    # Hate / slurs (basic sample, expand as needed)
+    r"racist|hate\s*speech|lynch",
+]
+_MODERATION_RE = re.compile(r"\b(?:" + "|".join(_MODERATION_PATTERNS) + r")\b", re.IGNORECASE)
+_ADDITIONAL_INQUIRIES_RE = re.compile(r"\badditional\s+inquir", re.IGNORECASE)
 
 # Basic content moderation function (simple keyword filter; expand with NLP if needed)
 def is_moderated(content):
-    # Comprehensive moderation list: dangerous, sexual, and cursing
     if not content:
         return False
-    text = str(content).lower()
-    patterns = [
-        # Cursing / profanity
-        r"\b(fuck|shit|bitch|asshole|bastard|dick|pussy|motherfucker|mf|cunt|slut|whore|prick)\b",
-        # Sexual content
-        r"\b(sex|sexual|porn|pornography|nude|nudity|blowjob|handjob|anal|fetish|erotic|xxx)\b",
-        # Dangerous / violent / illegal
-        r"\b(bomb|kill|murder|suicide|terror(ist|ism)?|attack|shoot(ing)?|gun|weapon|drugs?|heroin|cocaine|meth|hack(ing|er)?|breach)\b",
-        # Hate / slurs (basic sample, expand as needed)
-        r"\b(racist|hate\s*speech|lynch)\b",
-    ]
-    try:
-        for pat in patterns:
-            if re.search(pat, text, flags=re.IGNORECASE):
-                return True
-        return False
-    except Exception:
-        # Fail-safe: if regex fails, do not moderate
-        return False
+    return _MODERATION_RE.search(str(content)) is not None
 
 # Detect intent to escalate to human staff when user mentions 'additional inquiries'
 def is_additional_inquiries(content: str) -> bool:
-    try:
-        if not content:
-            return False
-        return re.search(r"\badditional\s+inquir", str(content), re.IGNORECASE) is not None
-    except Exception:
+    if not content:
         return False
+    return _ADDITIONAL_INQUIRIES_RE.search(str(content)) is not None
 
 # Login required decorator
 def login_required(f):
@@ -239,12 +431,18 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT password FROM users WHERE username = ?', (username,))
-        row = cursor.fetchone()
-        conn.close()
-        if row and check_password_hash(row[0], password):
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, password FROM users WHERE username = ?', (username,))
+            row = cursor.fetchone()
+            if row and verify_password(row[1], password):
+                # Upgrade legacy werkzeug hashes to bcrypt now that we know the plaintext
+                if row[1].startswith(LEGACY_HASH_PREFIXES):
+                    cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), row[0]))
+                    conn.commit()
+            else:
+                row = None
+        if row:
             session['logged_in'] = True
             return redirect(url_for('index'))
         # Render inline error on the login page
@@ -263,64 +461,65 @@ def forgot_password():
         # Generate token
         token = secrets.token_urlsafe(32)
         expires_at = datetime.now() + timedelta(hours=1)
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO password_reset_tokens (email, token, expires_at) VALUES (?, ?, ?)',
-                       (email, token, expires_at))
-        conn.commit()
-        conn.close()
-        # Send email
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO password_reset_tokens (email, token, expires_at) VALUES (?, ?, ?)',
+                           (email, token, expires_at))
+            conn.commit()
+        # Send email in the background; take a settings snapshot so the worker never touches SQLite
         reset_link = url_for('reset_password', token=token, _external=True)
-        msg = MIMEMultipart()
-        msg['From'] = get_setting('smtp_username')
-        msg['To'] = email
-        msg['Subject'] = 'Password Reset Request'
-        body = f'Click here to reset your password: {reset_link}'
-        msg.attach(MIMEText(body, 'plain'))
-        try:
-            server = smtplib.SMTP(get_setting('smtp_server'), int(get_setting('smtp_port')))
-            server.starttls()
-            server.login(get_setting('smtp_username'), get_setting('smtp_password'))
-            server.sendmail(get_setting('smtp_username'), email, msg.as_string())
-            server.quit()
-            return jsonify({'success': True, 'message': 'Reset link sent to your email.'})
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Error sending email: {str(e)}'}), 500
+        smtp_cfg = get_settings(['smtp_server', 'smtp_port', 'smtp_username', 'smtp_password'])
+        EMAIL_POOL.submit(_send_reset_email, email, reset_link, smtp_cfg)
+        return jsonify({'success': True, 'message': 'Reset link sent to your email.'})
     return render_template('forgot_password.html')
 
+# Background task: deliver a password reset link over SMTP (failures are logged, not raised)
+def _send_reset_email(email, reset_link, smtp_cfg):
+    msg = MIMEMultipart()
+    msg['From'] = smtp_cfg['smtp_username']
+    msg['To'] = email
+    msg['Subject'] = 'Password Reset Request'
+    body = f'Click here to reset your password: {reset_link}'
+    msg.attach(MIMEText(body, 'plain'))
+    try:
+        server = smtplib.SMTP(smtp_cfg['smtp_server'], int(smtp_cfg['smtp_port']), timeout=30)
+        server.starttls()
+        server.login(smtp_cfg['smtp_username'], smtp_cfg['smtp_password'])
+        server.sendmail(smtp_cfg['smtp_username'], email, msg.as_string())
+        server.quit()
+    except Exception:
+        app.logger.exception('Error sending password reset email to %s', email)
+
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT email, expires_at, used FROM password_reset_tokens WHERE token = ?', (token,))
-    row = cursor.fetchone()
-    if not row or row[2] or datetime.now() > datetime.fromisoformat(row[1]):
-        conn.close()
-        return 'Invalid or expired token.'
-    email = row[0]
-    if request.method == 'POST':
-        new_password = request.form['password']
-        hashed = generate_password_hash(new_password)
-        cursor.execute('UPDATE users SET password = ? WHERE email = ?', (hashed, email))
-        cursor.execute('UPDATE password_reset_tokens SET used = TRUE WHERE token = ?', (token,))
-        conn.commit()
-        conn.close()
-        return 'Password reset successful. <a href="/login">Login</a>'
-    conn.close()
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT email, expires_at, used FROM password_reset_tokens WHERE token = ?', (token,))
+        row = cursor.fetchone()
+        if not row or row[2] or datetime.now() > datetime.fromisoformat(row[1]):
+            return 'Invalid or expired token.'
+        email = row[0]
+        if request.method == 'POST':
+            new_password = request.form['password']
+            hashed = hash_password(new_password)
+            cursor.execute('UPDATE users SET password = ? WHERE email = ?', (hashed, email))
+            cursor.execute('UPDATE password_reset_tokens SET used = TRUE WHERE token = ?', (token,))
+            conn.commit()
+            return 'Password reset successful. <a href="/login">Login</a>'
     return render_template('reset_password.html', token=token)
 
 @app.route('/faqs', methods=['GET'])
 @login_required
 def get_faqs():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, question, answer, parent_id FROM faqs ORDER BY created_at DESC')
-    faqs = cursor.fetchall()
-    conn.close()
-    # Build a tree of FAQs with IDs included (needed by frontend for edit/delete)
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, question, answer, parent_id FROM faqs ORDER BY created_at DESC')
+        faqs = cursor.fetchall()
+    # Build a tree of FAQs with IDs included (needed by frontend for edit/delete).
+    # Two passes: rows are newest-first, so a sub-FAQ usually comes before its parent.
     faq_tree = {}
-    for faq in faqs:
-        fid, question, answer, parent_id = faq
+    subs = []
+    for fid, question, answer, parent_id in faqs:
         # Normalize parent_id: treat 0 or empty as None for compatibility
         try:
             parent_id_norm = None if (parent_id is None or int(parent_id) == 0) else int(parent_id)
@@ -335,22 +534,25 @@ def get_faqs():
                 'sub_faqs': []
             }
         else:
-            # If parent already in tree, append as sub-FAQ; otherwise, create a placeholder parent
-            if parent_id_norm not in faq_tree:
-                faq_tree[parent_id_norm] = {
-                    'id': parent_id_norm,
-                    'question': '',
-                    'answer': '',
-                    'parent_id': None,
-                    'sub_faqs': []
-                }
-            faq_tree[parent_id_norm]['sub_faqs'].append({
-                'id': fid,
-                'question': question,
-                'answer': answer,
-                'parent_id': parent_id_norm
-            })
-    return jsonify(list(faq_tree.values()))
+            subs.append((fid, question, answer, parent_id_norm))
+    for fid, question, answer, parent_id_norm in subs:
+        # Append to its parent; if the parent is missing, create a placeholder parent
+        parent = faq_tree.get(parent_id_norm)
+        if parent is None:
+            parent = faq_tree[parent_id_norm] = {
+                'id': parent_id_norm,
+                'question': '',
+                'answer': '',
+                'parent_id': None,
+                'sub_faqs': []
+            }
+        parent['sub_faqs'].append({
+            'id': fid,
+            'question': question,
+            'answer': answer,
+            'parent_id': parent_id_norm
+        })
+    return ojson(list(faq_tree.values()))
 
 @app.route('/add_faq', methods=['POST'])
 @login_required
@@ -369,14 +571,12 @@ def add_faq():
                 parent_id = None
     except Exception:
         parent_id = None
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)',
-                   (question, answer, parent_id))
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
-    return jsonify({'id': new_id, 'question': question, 'answer': answer, 'parent_id': parent_id})
+    with get_conn() as conn, conn:
+        cursor = conn.execute('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)',
+                              (question, answer, parent_id))
+        new_id = cursor.lastrowid
+    clear_response_cache()
+    return ojson({'id': new_id, 'question': question, 'answer': answer, 'parent_id': parent_id})
 
 @app.route('/update_faq/<int:faq_id>', methods=['PUT'])
 @login_required
@@ -384,13 +584,11 @@ def update_faq(faq_id):
     data = request.json
     question = data['question']
     answer = data['answer']
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE faqs SET question = ?, answer = ? WHERE id = ?',
-                   (question, answer, faq_id))
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True})
+    with get_conn() as conn, conn:
+        conn.execute('UPDATE faqs SET question = ?, answer = ? WHERE id = ?',
+                     (question, answer, faq_id))
+    clear_response_cache()
+    return ojson({'success': True})
 
 # New: API endpoint matching frontend for training from a URL
 @app.route('/api/train-url', methods=['POST'])
@@ -425,12 +623,12 @@ def api_train_url():
         pass
     # Purge old trainings not related to current company/domain
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # Prefer domain column; also clean legacy entries with NULL domain
-        cursor.execute('DELETE FROM knowledge WHERE domain IS NULL OR domain != ?', (domain,))
-        conn.commit()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            # Prefer domain column; also clean legacy entries with NULL domain
+            cursor.execute('DELETE FROM knowledge WHERE domain IS NULL OR domain != ?', (domain,))
+            conn.commit()
+        clear_response_cache()
     except Exception:
         # Non-fatal; continue training
         pass
@@ -449,20 +647,16 @@ def api_train_url():
             crawled += 1
             if data:
                 try:
-                    save_to_knowledge(data)
-                    saved += 1
+                    saved += save_to_knowledge(data)
                 except Exception as e:
                     last_error = f'save_to_knowledge failed for {current}: {e}'
             # Enqueue links for deep crawl
             if deep:
                 try:
-                    resp = requests.get(current, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-                    if resp.status_code == 200:
-                        # Only consider HTML content
-                        ctype = resp.headers.get('Content-Type', '')
-                        if 'html' not in ctype.lower():
-                            continue
-                        links = re.findall(r'href=["\'](.*?)["\']', resp.text)
+                    # Only consider HTML content
+                    html = _fetch_html(current)
+                    if html is not None:
+                        links = re.findall(r'href=["\'](.*?)["\']', html)
                         for link in links:
                             try:
                                 absolute = urljoin(current, link)
@@ -487,7 +681,7 @@ def api_train_url():
                     pass
         # If nothing saved, report a helpful failure so UI won't show Unknown error
         if saved == 0:
-            msg = 'No pages could be saved. The site may block bots, contain no parsable HTML, or be outside allowed domain.'
+            msg = 'No pages could be saved. The site may block bots, contain no parsable HTML, be outside allowed domain, or all pages may already be stored.'
             if last_error:
                 msg += f' Last error: {last_error}'
             return jsonify({'success': False, 'error': msg, 'pages_crawled': crawled, 'pages_saved': saved}), 200
@@ -526,13 +720,13 @@ def api_delete_faq(faq_id):
 @login_required
 def api_clear_all_faqs():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM faqs')
-        (count_before,) = cursor.fetchone()
-        cursor.execute('DELETE FROM faqs')
-        conn.commit()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM faqs')
+            (count_before,) = cursor.fetchone()
+            cursor.execute('DELETE FROM faqs')
+            conn.commit()
+        clear_response_cache()
         return jsonify({'success': True, 'deleted': count_before})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -558,18 +752,18 @@ def api_clear_training():
         domain = (data.get('domain') or '').strip()
         if not domain and not delete_all:
             domain = get_setting('current_domain', None)
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        if delete_all:
-            cursor.execute('DELETE FROM knowledge')
-        elif domain:
-            cursor.execute('DELETE FROM knowledge WHERE domain = ?', (domain,))
-        else:
-            # If no domain is set, clear legacy entries with NULL domain
-            cursor.execute('DELETE FROM knowledge WHERE domain IS NULL')
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            if delete_all:
+                cursor.execute('DELETE FROM knowledge')
+            elif domain:
+                cursor.execute('DELETE FROM knowledge WHERE domain = ?', (domain,))
+            else:
+                # If no domain is set, clear legacy entries with NULL domain
+                cursor.execute('DELETE FROM knowledge WHERE domain IS NULL')
+            deleted = cursor.rowcount
+            conn.commit()
+        clear_response_cache()
         # Optionally reset current_domain if we cleared it
         if (delete_all or domain) and (data.get('reset_current', True)):
             update_setting('current_domain', '')
@@ -620,20 +814,18 @@ def api_chat():
 @app.route('/api/faq-answer/<int:faq_id>', methods=['GET'])
 @login_required
 def api_faq_answer(faq_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, question, answer FROM faqs WHERE id = ?', (faq_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return jsonify({'error': 'FAQ not found'}), 404
-    cursor.execute('SELECT id, question, answer FROM faqs WHERE parent_id = ?', (faq_id,))
-    subs = cursor.fetchall()
-    conn.close()
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, question, answer FROM faqs WHERE id = ?', (faq_id,))
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({'error': 'FAQ not found'}), 404
+        cursor.execute('SELECT id, question, answer FROM faqs WHERE parent_id = ?', (faq_id,))
+        subs = cursor.fetchall()
     # If this FAQ represents Additional Inquiries, enable handoff in session and override answer
     try:
         qtext = (row[1] or '').strip()
-        if re.search(r"\badditional\s+inquir", qtext, re.IGNORECASE):
+        if is_additional_inquiries(qtext):
             session['handoff'] = True
             handoff_text = "Please leave us a message. We value your interest and will respond to your questions promptly."
             return jsonify({
@@ -728,29 +920,26 @@ def handle_unexpected_exception(e):
 @app.route('/delete_faq/<int:faq_id>', methods=['DELETE'])
 @login_required
 def delete_faq(faq_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Delete sub-FAQs first
-    cursor.execute('DELETE FROM faqs WHERE parent_id = ?', (faq_id,))
-    cursor.execute('DELETE FROM faqs WHERE id = ?', (faq_id,))
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True})
+    with get_conn() as conn, conn:
+        # Delete sub-FAQs first
+        conn.execute('DELETE FROM faqs WHERE parent_id = ?', (faq_id,))
+        conn.execute('DELETE FROM faqs WHERE id = ?', (faq_id,))
+    clear_response_cache()
+    return ojson({'success': True})
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     if request.method == 'POST':
         data = request.json
-        for key, value in data.items():
-            update_setting(key, value)
-        return jsonify({'success': True})
+        update_settings(data)
+        return ojson({'success': True})
     settings_keys = [
         'whatsapp_api_token', 'whatsapp_phone_number', 'whatsapp_phone_number_id', 'webhook_verify_token', 'greeting_message',
         'smtp_server', 'smtp_port', 'smtp_username', 'smtp_password', 'admin_email'
     ]
-    settings_dict = {key: get_setting(key, '') for key in settings_keys}
-    return jsonify(settings_dict)
+    settings_dict = get_settings(settings_keys, '')
+    return ojson(settings_dict)
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -765,12 +954,15 @@ def webhook():
             return request.args.get('hub.challenge')
         return 'Verification failed', 403
     elif request.method == 'POST':
-        data = request.json
-        # Defensive checks for structure
+        # Parse the raw body directly (Meta posts these constantly); no need to keep a cached copy
         try:
-            changes = data.get('entry', [])[0].get('changes', [])[0].get('value', {})
-            msgs = changes.get('messages', [])
-        except Exception:
+            data = json_loads(request.get_data(cache=False))
+        except ValueError:
+            return 'Invalid payload', 400
+        # Defensive checks for structure: status callbacks (delivery/read receipts) carry no 'messages'
+        try:
+            msgs = data['entry'][0]['changes'][0]['value'].get('messages', [])
+        except (KeyError, IndexError, TypeError, AttributeError):
             msgs = []
         if msgs:
             message = msgs[0]
@@ -778,79 +970,100 @@ def webhook():
             text = message.get('text', {}).get('body', '') if isinstance(message.get('text'), dict) else ''
             # Moderate content: reply with warning and do not process further
             if text and is_moderated(text):
-                send_whatsapp_message(sender, "🚫 Content Guidelines Reminder\nYour message contains language that doesn't align with our professional community guidelines. Please revise your content to maintain a respectful environment.")
+                send_whatsapp_message_async(sender, "🚫 Content Guidelines Reminder\nYour message contains language that doesn't align with our professional community guidelines. Please revise your content to maintain a respectful environment.")
                 return 'Moderated', 200
             # Human handoff: if guest TYPES inquiries, thank and leave for staff
             if text and is_additional_inquiries(text):
-                send_whatsapp_message(sender, "Thank you for your message. Our team will respond to you shortly.")
+                send_whatsapp_message_async(sender, "Thank you for your message. Our team will respond to you shortly.")
                 return 'Handoff to human', 200
             # Greeting logic per WhatsApp sender
             try:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute('SELECT welcomed FROM contacts WHERE phone = ?', (sender,))
-                row = cursor.fetchone()
-                if not row:
-                    cursor.execute('INSERT INTO contacts (phone, welcomed, last_seen) VALUES (?, ?, ?)', (sender, False, datetime.now()))
-                    conn.commit()
-                    welcomed = False
-                else:
-                    welcomed = bool(row[0])
-                # Update last seen
-                cursor.execute('UPDATE contacts SET last_seen = ? WHERE phone = ?', (datetime.now(), sender))
-                conn.commit()
+                with get_conn() as conn, conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT welcomed FROM contacts WHERE phone = ?', (sender,))
+                    row = cursor.fetchone()
+                    if not row:
+                        cursor.execute('INSERT INTO contacts (phone, welcomed, last_seen) VALUES (?, ?, ?)', (sender, False, datetime.now()))
+                        welcomed = False
+                    else:
+                        welcomed = bool(row[0])
+                    # Update last seen
+                    cursor.execute('UPDATE contacts SET last_seen = ? WHERE phone = ?', (datetime.now(), sender))
             except Exception:
                 welcomed = True  # fail open to avoid greeting loop
-            finally:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
             if text and not welcomed:
                 greet = get_setting('greeting_message', 'Hello!')
-                send_whatsapp_message(sender, greet)
+                send_whatsapp_message_async(sender, greet)
                 # Mark welcomed
                 try:
-                    conn = sqlite3.connect(DB_PATH)
-                    cursor = conn.cursor()
-                    cursor.execute('UPDATE contacts SET welcomed = TRUE WHERE phone = ?', (sender,))
-                    conn.commit()
-                    conn.close()
+                    with get_conn() as conn, conn:
+                        conn.execute('UPDATE contacts SET welcomed = TRUE WHERE phone = ?', (sender,))
                 except Exception:
                     pass
             else:
                 # Find matching FAQ or knowledge
                 response = find_response(text)
-                send_whatsapp_message(sender, response)
+                send_whatsapp_message_async(sender, response)
         return 'OK', 200
 
+# Words too common to identify an FAQ or page on their own; a message made only of these gets the greeting
+_STOPWORDS = frozenset('''
+    a an the and or but if of to in on at by for from with about as into over is are was were be been am do does did
+    it its this that these those there here i me my we our you your he she they them his her their what which who whom
+    when where why how can could would should will shall may might must please hi hello any some no not so
+'''.split())
+
+# Helper: turn free text into an FTS5 query matching all of its non-stopword words
+# (quoted, so no FTS syntax leaks through)
+def _fts_query(text):
+    tokens = [t for t in re.findall(r'\w+', str(text or '').lower()) if t not in _STOPWORDS]
+    return ' '.join(f'"{t}"' for t in tokens)
+
+# Reply cache: repeated questions (greetings, pricing, ...) skip SQLite entirely. It is cleared on every
+# FAQ/knowledge/settings write in this process and every SETTINGS_CACHE_TTL seconds for other workers' writes.
+RESPONSE_CACHE_SIZE = 1024
+_response_cache_cleared_at = time.monotonic()
+
+def clear_response_cache():
+    global _response_cache_cleared_at
+    _find_response_cached.cache_clear()
+    _response_cache_cleared_at = time.monotonic()
+
 def find_response(query):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Search FAQs
-    cursor.execute('SELECT answer FROM faqs WHERE question LIKE ? LIMIT 1', (f'%{query}%',))
-    row = cursor.fetchone()
-    if row:
-        conn.close()
-        return row[0]
-    # Search knowledge base scoped to current domain and most recent
+    if time.monotonic() - _response_cache_cleared_at >= SETTINGS_CACHE_TTL:
+        clear_response_cache()
+    return _find_response_cached(str(query or '').strip().lower())
+
+@lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def _find_response_cached(query):
+    match = _fts_query(query)
     current_domain = get_setting('current_domain', None)
-    if current_domain:
-        # Try title match first, then content; prefer most recent
-        cursor.execute('SELECT content FROM knowledge WHERE domain = ? AND title LIKE ? ORDER BY created_at DESC LIMIT 1', (current_domain, f'%{query}%'))
-        row = cursor.fetchone()
-        if row:
-            conn.close()
-            return row[0]
-        cursor.execute('SELECT content FROM knowledge WHERE domain = ? AND content LIKE ? ORDER BY created_at DESC LIMIT 1', (current_domain, f'%{query}%'))
-        row = cursor.fetchone()
-        if row:
-            conn.close()
-            return row[0]
-    # Fallback: legacy entries without domain (least preferred)
-    cursor.execute('SELECT content FROM knowledge WHERE domain IS NULL AND (title LIKE ? OR content LIKE ?) ORDER BY created_at DESC LIMIT 1', (f'%{query}%', f'%{query}%'))
-    row = cursor.fetchone()
-    conn.close()
+    row = None
+    if match:
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            # Search FAQ questions (answers are free text and would match on stopwords)
+            cursor.execute('SELECT answer FROM faqs_fts WHERE faqs_fts MATCH ? ORDER BY bm25(faqs_fts) LIMIT 1', (f'question : ({match})',))
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            # Search knowledge base scoped to current domain; title hits outrank content, then most recent
+            if current_domain:
+                cursor.execute('''
+                    SELECT k.content FROM knowledge_fts JOIN knowledge k ON k.id = knowledge_fts.rowid
+                    WHERE knowledge_fts MATCH ? AND k.domain = ?
+                    ORDER BY bm25(knowledge_fts, 10.0, 1.0), k.created_at DESC LIMIT 1
+                ''', (match, current_domain))
+                row = cursor.fetchone()
+                if row:
+                    return row[0]
+            # Fallback: legacy entries without domain (least preferred)
+            cursor.execute('''
+                SELECT k.content FROM knowledge_fts JOIN knowledge k ON k.id = knowledge_fts.rowid
+                WHERE knowledge_fts MATCH ? AND k.domain IS NULL
+                ORDER BY bm25(knowledge_fts, 10.0, 1.0), k.created_at DESC LIMIT 1
+            ''', (match,))
+            row = cursor.fetchone()
     if row:
         return row[0]
     # Fallback to configured greeting message as the default assistant response
@@ -867,22 +1080,23 @@ def _truncate_response(text, limit=600):
 # Helper: fetch top-level FAQs as suggestions
 def get_main_faq_suggestions(limit=9):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, question FROM faqs WHERE parent_id IS NULL ORDER BY created_at DESC LIMIT ?', (limit,))
-        rows = cursor.fetchall()
-        # Fallback: if no main FAQs exist, return most recent FAQs regardless of parent
-        if not rows:
-            cursor.execute('SELECT id, question FROM faqs ORDER BY created_at DESC LIMIT ?', (limit,))
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, question FROM faqs WHERE parent_id IS NULL ORDER BY created_at DESC LIMIT ?', (limit,))
             rows = cursor.fetchall()
-        conn.close()
+            # Fallback: if no main FAQs exist, return most recent FAQs regardless of parent
+            if not rows:
+                cursor.execute('SELECT id, question FROM faqs ORDER BY created_at DESC LIMIT ?', (limit,))
+                rows = cursor.fetchall()
         return [{'id': r[0], 'question': r[1]} for r in rows]
     except Exception:
         return []
 
 def send_whatsapp_message(to, text):
-    token = get_setting('whatsapp_api_token')
-    phone_number = get_setting('whatsapp_phone_number')
+    # Served from the settings cache, so building the URL costs no SQLite query
+    cfg = get_settings(['whatsapp_api_token', 'whatsapp_phone_number'])
+    token = cfg['whatsapp_api_token']
+    phone_number = cfg['whatsapp_phone_number']
     url = f'https://graph.facebook.com/v13.0/{phone_number}/messages'
     headers = {'Authorization': f'Bearer {token}'}
     data = {
@@ -891,48 +1105,156 @@ def send_whatsapp_message(to, text):
         'type': 'text',
         'text': {'body': text}
     }
-    requests.post(url, headers=headers, json=data)
+    GRAPH_SESSION.post(url, headers=headers, json=data, timeout=GRAPH_TIMEOUT)
+
+# Queue a WhatsApp reply on WA_POOL; nobody waits on the result, so failures are logged
+def send_whatsapp_message_async(to, text):
+    WA_POOL.submit(_send_whatsapp_logged, to, text)
+
+def _send_whatsapp_logged(to, text):
+    try:
+        send_whatsapp_message(to, text)
+    except Exception:
+        app.logger.exception('Error sending WhatsApp message to %s', to)
 
 @app.route('/train', methods=['POST'])
 @login_required
 def train():
     data = request.get_json(silent=True)
     if not data or 'urls' not in data or not isinstance(data['urls'], list):
-        return jsonify({'error': 'Invalid payload. Expecting JSON body with key "urls" as a list.'}), 400
+        return ojson({'error': 'Invalid payload. Expecting JSON body with key "urls" as a list.'}, 400)
     urls = data['urls']
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(crawl_url, url) for url in urls]
-        for future in as_completed(futures):
-            data = future.result()
-            if data:
-                save_to_knowledge(data)
-    return jsonify({'success': True})
+    if AIOHTTP_AVAILABLE:
+        results = asyncio.run(_crawl_many(urls))
+    else:
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(crawl_url, url) for url in urls]
+            results = [future.result() for future in as_completed(futures)]
+    # One batched insert instead of a connection and commit per page
+    save_many_to_knowledge([data for data in results if data])
+    return ojson({'success': True})
 
 def crawl_url(url):
     try:
-        response = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-        if response.status_code != 200:
+        # Skip non-HTML content quickly using URL extension (before downloading) or Content-Type
+        if _is_asset_url(url):
+            return None
+        html = _fetch_html(url)
+        if html is None:
+            return None
+        return _parse_html(url, html)
+    except Exception:
+        return None
+
+# Helper: URLs that point at static assets rather than pages
+def _is_asset_url(url):
+    path = urlparse(url).path.lower()
+    return re.search(r'\.(css|js|json|xml|txt|ico|woff2?|ttf|eot|otf|map)($|\?)', path) is not None
+
+# Crawl many URLs on one event loop. Concurrency is bounded by a semaphore taken before each request (not by
+# the connector queue), so URLs waiting their turn don't spend their timeout before they are even sent.
+async def _crawl_many(urls):
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=CRAWL_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': 'Mozilla/5.0'}) as client:
+        return await asyncio.gather(*[_crawl_url_async(client, semaphore, url) for url in urls])
+
+# Async counterpart of crawl_url: same filtering, size cap, per-request timeout and retries
+# (CRAWL_RETRIES mirrors the sync adapter's Retry(total=2)), same result shape
+async def _crawl_url_async(client, semaphore, url):
+    # Any failure on one URL (malformed entry, network error, bad HTML) yields None so the rest still get saved
+    try:
+        if _is_asset_url(url):
             return None
-        # Skip non-HTML content quickly using Content-Type or URL extension
+        async with semaphore:
+            for attempt in range(CRAWL_RETRIES + 1):
+                try:
+                    html = await _fetch_html_async(client, url)
+                    break
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt == CRAWL_RETRIES:
+                        return None
+                    await asyncio.sleep(0.3 * 2 ** attempt)
+        if html is None:
+            return None
+        return _parse_html(url, html)
+    except Exception:
+        return None
+
+async def _fetch_html_async(client, url):
+    async with client.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
         ctype = response.headers.get('Content-Type', '')
-        path = urlparse(url).path.lower()
-        if ('html' not in ctype.lower()) or re.search(r'\.(css|js|json|xml|txt|ico|woff2?|ttf|eot|otf|map)($|\?)', path):
+        if response.status != 200 or 'html' not in ctype.lower():
             return None
-        # Simple HTML parsing (use BeautifulSoup for better if installed, but avoid extra deps)
-        content = re.sub('<[^<]+?>', '', response.text)  # Strip tags
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= CRAWL_MAX_BYTES:
+                break
+        encoding = response.charset or 'utf-8'
+    return b''.join(chunks)[:CRAWL_MAX_BYTES].decode(encoding, 'replace')
+
+# Helper: stream an HTML page through the shared session, reading at most CRAWL_MAX_BYTES.
+# Returns None for non-200 responses and non-HTML content types.
+def _fetch_html(url):
+    with CRAWL_SESSION.get(url, timeout=10, stream=True) as response:
+        ctype = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or 'html' not in ctype.lower():
+            return None
+        body = response.raw.read(CRAWL_MAX_BYTES, decode_content=True)
+    # Without an explicit charset requests assumes ISO-8859-1; most pages are UTF-8
+    encoding = response.encoding if 'charset' in ctype.lower() else 'utf-8'
+    return body.decode(encoding or 'utf-8', 'replace')
+
+# Helper: extract title, visible text and image URLs from an HTML page
+def _parse_html(url, html):
+    if SELECTOLAX_AVAILABLE:
+        # Single pass through a C parser; drop non-visible script/style text
+        tree = LexborHTMLParser(html)
+        title_node = tree.css_first('title')
+        title = title_node.text(strip=True) if title_node else ''
+        images = [urljoin(url, node.attributes.get('src') or '') for node in tree.css('img[src]')]
+        for node in tree.css('script, style, noscript'):
+            node.decompose()
+        root = tree.body or tree.root
+        content = root.text(separator=' ', strip=True) if root else ''
+    else:
+        # Simple regex parsing when selectolax isn't installed
+        content = re.sub('<[^<]+?>', '', html)  # Strip tags
         content = unescape(content)
-        title = re.search('<title>(.*?)</title>', response.text)
+        title = re.search('<title>(.*?)</title>', html)
         title = title.group(1) if title else ''
-        # Extract images
-        images = re.findall(r'<img.*?src="(.*?)"', response.text)
+        images = re.findall(r'<img.*?src="(.*?)"', html)
         images = [urljoin(url, img) for img in images]
-        return {'url': url, 'title': title, 'content': content, 'images': json.dumps(images)}
-    except Exception:
-        return None
+    return {'url': url, 'title': title, 'content': content, 'images': json.dumps(images), 'content_sha': _content_sha(content)}
+
+# Helper: short content fingerprint for de-duplicating knowledge rows (BLAKE2 is fast and in hashlib)
+def _content_sha(content):
+    return hashlib.blake2b((content or '').encode('utf-8'), digest_size=16).hexdigest()
 
 def save_to_knowledge(data):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    return save_many_to_knowledge([data])
+
+# Insert crawled pages in a single transaction, skipping content already stored; returns how many rows were written
+def save_many_to_knowledge(items):
+    rows = [row for row in (_knowledge_row(data) for data in items) if row]
+    if not rows:
+        return 0
+    with get_conn() as conn, conn:
+        # Insert with domain/content_sha if the columns exist; fallback to legacy insert
+        try:
+            cursor = conn.executemany('INSERT OR IGNORE INTO knowledge (url, title, content, images, domain, content_sha) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        except Exception:
+            cursor = conn.executemany('INSERT INTO knowledge (url, title, content, images) VALUES (?, ?, ?, ?)',
+                                      [row[:4] for row in rows])
+        written = cursor.rowcount
+    clear_response_cache()
+    return written
+
+# Helper: turn a crawl result into a knowledge row, or None if it isn't worth saving
+def _knowledge_row(data):
     try:
         dom = urlparse(data['url']).netloc
     except Exception:
@@ -942,22 +1264,13 @@ def save_to_knowledge(data):
         p = urlparse(data.get('url', '')).path.lower()
         content_snippet = (data.get('content') or '')[:2000]
         if re.search(r'\.(css|js|json|xml|txt|ico|woff2?|ttf|eot|otf|map)($|\?)', p):
-            conn.close()
-            return
+            return None
         if ('@font-face' in content_snippet) or ('@charset' in content_snippet) or content_snippet.strip().startswith('/*'):
-            conn.close()
-            return
+            return None
     except Exception:
         pass
-    # Insert with domain if column exists; fallback to legacy insert
-    try:
-        cursor.execute('INSERT INTO knowledge (url, title, content, images, domain) VALUES (?, ?, ?, ?, ?)',
-                       (data['url'], data['title'], data['content'], data['images'], dom))
-    except Exception:
-        cursor.execute('INSERT INTO knowledge (url, title, content, images) VALUES (?, ?, ?, ?)',
-                       (data['url'], data['title'], data['content'], data['images']))
-    conn.commit()
-    conn.close()
+    content_sha = data.get('content_sha') or _content_sha(data['content'])
+    return (data['url'], data['title'], data['content'], data['images'], dom, content_sha)
 
 @app.route('/api/knowledge-delete', methods=['POST'])
 @login_required
@@ -981,12 +1294,12 @@ def api_knowledge_delete():
             if current:
                 where += ' AND domain = ?'
                 params.append(current)
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(f'DELETE FROM knowledge WHERE {where}', tuple(params))
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'DELETE FROM knowledge WHERE {where}', tuple(params))
+            deleted = cursor.rowcount
+            conn.commit()
+        clear_response_cache()
         return jsonify({'success': True, 'deleted': deleted})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -994,30 +1307,19 @@ def api_knowledge_delete():
 @app.route('/export_faqs', methods=['GET'])
 @login_required
 def export_faqs():
-    if not PANDAS_AVAILABLE or not OPENPYXL_AVAILABLE:
-        return jsonify({'error': 'Excel export requires pandas and openpyxl installed.'}), 400
-    # Select only needed fields and compute a Type column
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query('SELECT id, question, answer, parent_id FROM faqs ORDER BY id ASC', conn)
-    conn.close()
-    # Add Type column: Main FAQ when parent_id is NULL, else Sub-FAQ
-    def _type_from_parent(pid):
-        try:
-            return 'Main FAQ' if pd.isna(pid) or pid is None else 'Sub-FAQ'
-        except Exception:
-            return 'Main FAQ'
-    if not df.empty:
-        df['Type'] = df['parent_id'].apply(_type_from_parent)
-        # Reorder columns for clarity
-        df = df[['id', 'question', 'answer', 'Type', 'parent_id']]
-        # Rename parent_id to Parent ID for friendlier Excel header
-        df = df.rename(columns={'parent_id': 'Parent ID', 'id': 'ID', 'question': 'Question', 'answer': 'Answer'})
-    else:
-        # Create an empty template with proper headers
-        df = pd.DataFrame(columns=['ID', 'Question', 'Answer', 'Type', 'Parent ID'])
+    if not OPENPYXL_AVAILABLE:
+        return jsonify({'error': 'Excel export requires openpyxl installed.'}), 400
+    # Stream rows from SQLite straight into a write-only workbook (no DataFrame of the whole table)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('FAQs')
+    ws.append(['ID', 'Question', 'Answer', 'Type', 'Parent ID'])
+    with get_conn() as conn:
+        for fid, question, answer, parent_id in conn.execute('SELECT id, question, answer, parent_id FROM faqs ORDER BY id ASC'):
+            # Type column: Main FAQ when parent_id is NULL, else Sub-FAQ
+            faq_type = 'Main FAQ' if parent_id is None else 'Sub-FAQ'
+            ws.append([fid, question, answer, faq_type, parent_id])
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='FAQs')
+    wb.save(output)
     output.seek(0)
     return send_file(output, as_attachment=True, download_name='faqs.xlsx')
 
@@ -1025,16 +1327,16 @@ def export_faqs():
 @login_required
 def import_faqs():
     if not PANDAS_AVAILABLE or not OPENPYXL_AVAILABLE:
-        return jsonify({'error': 'Excel import requires pandas and openpyxl installed.'}), 400
+        return ojson({'error': 'Excel import requires pandas and openpyxl installed.'}, 400)
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part in the request.'}), 400
+        return ojson({'error': 'No file part in the request.'}, 400)
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file.'}), 400
+        return ojson({'error': 'No selected file.'}, 400)
     try:
         df = pd.read_excel(file)
     except Exception as e:
-        return jsonify({'error': f'Failed to read Excel file: {str(e)}'}), 400
+        return ojson({'error': f'Failed to read Excel file: {str(e)}'}, 400)
     # Normalize column names to ease matching
     rename_map = {}
     for c in df.columns:
@@ -1055,7 +1357,7 @@ def import_faqs():
     required = {'question', 'answer'}
     missing = [c for c in required if c not in df.columns]
     if missing:
-        return jsonify({'error': f"Missing required columns: {', '.join(missing)}"}), 400
+        return ojson({'error': f"Missing required columns: {', '.join(missing)}"}, 400)
 
     has_parent = 'parent_id' in df.columns
     has_type = 'Type' in df.columns
@@ -1079,18 +1381,23 @@ def import_faqs():
         except Exception:
             return None
 
-    # Preprocess rows into dicts for easier handling
-    rows = []
-    for _, r in df.iterrows():
-        q = ('' if (pd.isna(r['question']) if 'question' in r else True) else str(r['question']).strip())
-        a = ('' if (pd.isna(r['answer']) if 'answer' in r else True) else str(r['answer']).strip())
-        tval = None
-        if has_type:
-            tv = r['Type']
-            tval = ('' if pd.isna(tv) else str(tv)).strip().lower()
-        pval = _parse_int(r['parent_id']) if has_parent else None
-        oid = _parse_int(r['ID']) if has_id else None
-        rows.append({'orig_id': oid, 'question': q, 'answer': a, 'type': tval, 'parent_ref': pval})
+    def _text_col(name):
+        return df[name].fillna('').astype(str).str.strip().tolist()
+
+    def _int_col(name):
+        return [_parse_int(v) for v in df[name].tolist()]
+
+    # Preprocess whole columns at once (much faster than iterrows), then zip into dicts for easier handling
+    blank = [None] * len(df)
+    questions = _text_col('question')
+    answers = _text_col('answer')
+    types = [t.lower() for t in _text_col('Type')] if has_type else blank
+    parent_refs = _int_col('parent_id') if has_parent else blank
+    orig_ids = _int_col('ID') if has_id else blank
+    rows = [
+        {'orig_id': oid, 'question': q, 'answer': a, 'type': tval, 'parent_ref': pval}
+        for oid, q, a, tval, pval in zip(orig_ids, questions, answers, types, parent_refs)
+    ]
 
     # Determine mains vs subs
     mains = []
@@ -1111,45 +1418,40 @@ def import_faqs():
     skipped_subs = 0
     id_map = {}  # maps original Excel ID -> DB ID
 
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # First pass: insert mains
-        for m in mains:
-            cursor.execute('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)', (m['question'], m['answer'], None))
-            db_id = cursor.lastrowid
-            inserted_mains += 1
-            if m['orig_id'] is not None:
-                id_map[m['orig_id']] = db_id
-        # Second pass: insert subs with mapped parent IDs
-        for s in subs:
-            pref = s['parent_ref']
-            db_parent = None
-            if pref is not None:
-                db_parent = id_map.get(pref)
-            if db_parent is None:
-                # Parent not found; skip safely
-                skipped_subs += 1
-                continue
-            cursor.execute('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)', (s['question'], s['answer'], db_parent))
-            inserted_subs += 1
-        conn.commit()
+        # One transaction for the whole import (rolled back on error)
+        with get_conn() as conn, conn:
+            cursor = conn.cursor()
+            # First pass: insert mains
+            cursor.executemany('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)',
+                               [(m['question'], m['answer'], None) for m in mains])
+            inserted_mains = len(mains)
+            if mains:
+                # The transaction holds the write lock, so the newest ids are exactly the rows just inserted
+                cursor.execute('SELECT id FROM faqs ORDER BY id DESC LIMIT ?', (len(mains),))
+                db_ids = [row[0] for row in reversed(cursor.fetchall())]
+                for m, db_id in zip(mains, db_ids):
+                    if m['orig_id'] is not None:
+                        id_map[m['orig_id']] = db_id
+            # Second pass: insert subs with mapped parent IDs
+            sub_rows = []
+            for s in subs:
+                pref = s['parent_ref']
+                db_parent = None
+                if pref is not None:
+                    db_parent = id_map.get(pref)
+                if db_parent is None:
+                    # Parent not found; skip safely
+                    skipped_subs += 1
+                    continue
+                sub_rows.append((s['question'], s['answer'], db_parent))
+            cursor.executemany('INSERT INTO faqs (question, answer, parent_id) VALUES (?, ?, ?)', sub_rows)
+            inserted_subs = len(sub_rows)
+        clear_response_cache()
     except Exception as e:
-        try:
-            if conn:
-                conn.rollback()
-        except Exception:
-            pass
-        return jsonify({'error': f'Database error during import: {str(e)}'}), 500
-    finally:
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+        return ojson({'error': f'Database error during import: {str(e)}'}, 500)
 
-    return jsonify({
+    return ojson({
         'success': True,
         'message': 'FAQs imported successfully.',
         'inserted_main': inserted_mains,